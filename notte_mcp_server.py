@@ -22,22 +22,127 @@ ENV esperadas no FastMCP Cloud:
 - LOCALE               (padrão pt-BR)
 - SKIP_GEO_CHECK       (True/False, padrão False)
 - FORCE_USE_MCP_ROUTER (True/False, padrão False)
+- MCP_BREAKER_FAILS    (falhas seguidas até abrir o circuito de um candidato, padrão 3)
+- MCP_BREAKER_COOLDOWN (segundos com o circuito aberto antes de nova tentativa, padrão 300)
 """
 
+import asyncio
+import atexit
+import contextlib
+import dataclasses
+import functools
+import hashlib
 import os
-import socket
-import traceback
-from typing import Optional, Any, Dict
-from urllib.parse import urlparse
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, AsyncIterator, NamedTuple, Optional, Any, Dict, List, Set, Tuple
 
 import anyio
-import requests
+import orjson
 
 from fastmcp import FastMCP  # <<<<<< usar FastMCP (não o pacote mcp)
-from notte_sdk import NotteClient
-from notte_sdk.types import NotteProxy
+try:
+    from fastmcp.tools import ToolResult
+except ImportError:  # fastmcp 2.13/2.14: ToolResult só existe em fastmcp.tools.tool
+    from fastmcp.tools.tool import ToolResult
+
+# notte_sdk, httpx, socket e traceback são importados dentro das funções que os usam:
+# o cold start (ex. só `health`) não paga o import do notte_sdk
+if TYPE_CHECKING:
+    import httpx
+    from notte_sdk import NotteClient
+    from notte_sdk.types import NotteProxy
+
+# clientes HTTP assíncronos: keep-alive reaproveita a conexão TCP/TLS entre chamadas.
+# chave None = saída direta; demais chaves = um cliente por candidato MCP (proxy é fixo por cliente no httpx),
+# em ordem LRU e limitados a _HTTPX_MAX_PROXIED (o discovery pode devolver endereços novos a cada chamada)
+_HTTPX: "OrderedDict[Optional[str], httpx.AsyncClient]" = OrderedDict()
+_HTTPX_MAX_PROXIED = 16
+_HTTPX_CLOSING: Set["asyncio.Task[None]"] = set()
+
+def _async_client(proxy: Optional[str] = None) -> "httpx.AsyncClient":
+    """Cliente httpx (criado na primeira chamada) para a saída direta ou via `proxy`."""
+    client = _HTTPX.get(proxy)
+    if client is not None:
+        _HTTPX.move_to_end(proxy)
+        return client
+    import httpx
+
+    if proxy is not None:
+        proxied = [k for k in _HTTPX if k is not None]
+        for old in proxied[: max(0, len(proxied) - _HTTPX_MAX_PROXIED + 1)]:
+            # sempre chamado de dentro do event loop: fecha o cliente despejado em background
+            task = asyncio.get_running_loop().create_task(_HTTPX.pop(old).aclose())
+            _HTTPX_CLOSING.add(task)
+            task.add_done_callback(_HTTPX_CLOSING.discard)
+
+    transport = httpx.AsyncHTTPTransport(
+        proxy=proxy,
+        http2=True,
+        retries=2,
+        limits=httpx.Limits(max_connections=8, max_keepalive_connections=4),
+    )
+    client = _HTTPX[proxy] = httpx.AsyncClient(
+        transport=transport,
+        timeout=10.0,
+        headers={"User-Agent": "notte-mcp/1.0"},
+        trust_env=False,  # não herda os *_PROXY que _set_env_proxy_vars escreve
+    )
+    return client
 
-app = FastMCP("notte-mcp")  # <<<<<< instância que o inspector do FastMCP procura
+@contextlib.asynccontextmanager
+async def _lifespan(server: Any) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Fecha os clientes httpx quando o servidor encerra (aclose precisa do event loop, não dá via atexit).
+    Requer fastmcp>=2.13: a partir dela o lifespan é do servidor (entra uma vez), não por sessão/request.
+    """
+    try:
+        yield {}
+    finally:
+        clients = list(_HTTPX.values())
+        _HTTPX.clear()
+        for client in clients:
+            with contextlib.suppress(Exception):
+                await client.aclose()
+
+app = FastMCP("notte-mcp", lifespan=_lifespan)  # <<<<<< instância que o inspector do FastMCP procura
+
+# cache do geo-check: chave (proxy/URL) -> (timestamp monotônico, resultado)
+_GEO_CACHE: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+_GEO_TTL = 600  # segundos
+_GEO_MAXSIZE = 256
+
+# cache do discovery FastCloud: (api_url, hash do token) -> (timestamp monotônico, endereço)
+# falha na API devolve o último valor enquanto tiver menos de 2 * _DISCO_TTL (stale-while-error)
+_DISCO_CACHE: Dict[Tuple[str, str], Tuple[float, str]] = {}
+_DISCO_TTL = 120  # segundos
+
+# cache de DNS: hostname -> (timestamp monotônico, endereço); TTL curto para não fixar IPs antigos
+_DNS_CACHE: Dict[str, Tuple[float, str]] = {}
+_DNS_TTL = 300  # segundos
+_DNS_MAXSIZE = 256
+
+# circuit breaker por candidato MCP: cand -> {"fails", "opened_at", "state"}
+# state: "closed" (normal) | "open" (pula o candidato) | "half" (uma tentativa de teste)
+_BREAKER: Dict[str, Dict[str, Any]] = {}
+_BREAKER_LOCK = threading.Lock()
+_BREAKER_FAILS = int(os.getenv("MCP_BREAKER_FAILS", "3"))
+_BREAKER_COOLDOWN = float(os.getenv("MCP_BREAKER_COOLDOWN", "300"))
+_BREAKER_MAXSIZE = 256
+
+# último candidato MCP que funcionou: vai para o início da fila na próxima chamada
+_LAST_GOOD: Optional[str] = None
+
+_PROXY_VARS = ("ALL_PROXY", "all_proxy", "HTTP_PROXY", "http_proxy", "HTTPS_PROXY", "https_proxy")
+# candidato MCP atualmente escrito nas variáveis *_PROXY (None = nenhum) e os valores
+# que existiam antes da primeira escrita (None = variável não existia), para restaurar depois
+_ENV_PROXY_SET: Optional[str] = None
+_ENV_PROXY_ORIG: Dict[str, Optional[str]] = {}
+
+_TRUTHY = frozenset({"1", "true", "yes", "on"})
 
 # --------------------------
 # Utils
@@ -45,11 +150,71 @@ app = FastMCP("notte-mcp")  # <<<<<< instância que o inspector do FastMCP procu
 def _str_to_bool(val: Optional[str], default: bool = False) -> bool:
     if val is None:
         return default
-    return str(val).strip().lower() in ("1", "true", "yes", "on")
+    if isinstance(val, bool):
+        return val
+    return val.strip().lower() in _TRUTHY if isinstance(val, str) else bool(val)
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Config:
+    """Configuração vinda das ENV (lida uma vez no import); overrides por chamada via dataclasses.replace."""
+    api_key: str
+    target_url: str
+    headless: bool
+    browser_type: str
+    locale: str
+    force_use_mcp_router: bool
+    skip_geo_check: bool
+    mcp_proxy_url: str
+    mcp_router_hostname: str
+    fastcloud_api_url: str
+    fastcloud_api_token: str
+
+_CFG = Config(
+    api_key=os.getenv("NOTTE_API_KEY", ""),
+    target_url=os.getenv("TARGET_URL", "https://shopee.com.br"),
+    headless=_str_to_bool(os.getenv("HEADLESS", "False"), default=False),
+    browser_type=os.getenv("BROWSER_TYPE", "firefox"),
+    locale=os.getenv("LOCALE", "pt-BR"),
+    force_use_mcp_router=_str_to_bool(os.getenv("FORCE_USE_MCP_ROUTER", "False")),
+    skip_geo_check=_str_to_bool(os.getenv("SKIP_GEO_CHECK", "False")),
+    mcp_proxy_url=os.getenv("MCP_PROXY_URL", "").strip(),
+    mcp_router_hostname=os.getenv("MCP_ROUTER_HOSTNAME", "").strip(),
+    fastcloud_api_url=os.getenv("FASTCLOUD_API_URL", "").strip(),
+    fastcloud_api_token=os.getenv("FASTCLOUD_API_TOKEN", "").strip(),
+)
+
+# scheme://[user:pass@]host[:port][/...] — basta para as URLs de proxy daqui, sem o custo do urlparse
+_URL_RE = re.compile(
+    r"^(?:(?P<scheme>[a-z0-9+.-]+)://)?"
+    r"(?:(?P<userinfo>[^/]*)@)?"
+    r"(?P<host>\[[^\]/]+\]|[^:/@\[\]\s]+)"
+    r"(?::(?P<port>\d+))?"
+    r"(?:/.*)?$",
+    re.I,
+)
+
+class _ProxyURL(NamedTuple):
+    scheme: Optional[str]
+    userinfo: Optional[str]
+    host: str
+    port: Optional[int]
+
+@functools.lru_cache(maxsize=128)
+def _parse_proxy_url(url: str) -> Optional[_ProxyURL]:
+    """Como urlparse: scheme/host em minúsculas e IPv6 sem colchetes; None se não casar."""
+    m = _URL_RE.match(url.strip())
+    if m is None:
+        return None
+    scheme = m["scheme"].lower() if m["scheme"] else None
+    host = m["host"].strip("[]").lower()
+    port = int(m["port"]) if m["port"] else None
+    return _ProxyURL(scheme, m["userinfo"], host, port)
 
-def _make_notte_proxy_from_url(url: Optional[str]) -> Optional[NotteProxy]:
+def _make_notte_proxy_from_url(url: Optional[str]) -> Optional["NotteProxy"]:
     if not url:
         return None
+    from notte_sdk.types import NotteProxy
+
     url = url.strip()
     # tenta NotteProxy.from_url
     try:
@@ -59,93 +224,323 @@ def _make_notte_proxy_from_url(url: Optional[str]) -> Optional[NotteProxy]:
         pass
     # tenta NotteProxy.from_host_port
     try:
-        parsed = urlparse(url)
-        scheme = parsed.scheme or "http"
-        host = parsed.hostname
-        port = parsed.port
-        if host and port and hasattr(NotteProxy, "from_host_port"):
-            return NotteProxy.from_host_port(host=host, port=port, scheme=scheme)
+        parsed = _parse_proxy_url(url)
+        if parsed and parsed.port and hasattr(NotteProxy, "from_host_port"):
+            return NotteProxy.from_host_port(host=parsed.host, port=parsed.port, scheme=parsed.scheme or "http")
     except Exception:
         pass
     return None
 
+@functools.lru_cache(maxsize=16)
+def _notte_proxy_country(cc: str) -> "NotteProxy":
+    # exceções não entram no lru_cache: uma falha pontual não "envenena" o cache
+    from notte_sdk.types import NotteProxy
+
+    return NotteProxy.from_country(cc)
+
+def _normalize_proxy_url(url: str) -> str:
+    """scheme/host em minúsculas, scheme padrão socks5 e porta 1080 para socks; mantém user:pass."""
+    url = url.strip()
+    parsed = _parse_proxy_url(url)
+    if parsed is None:
+        return url
+    scheme = parsed.scheme or "socks5"
+    port = parsed.port or (1080 if scheme.startswith("socks") else None)
+    host = f"[{parsed.host}]" if ":" in parsed.host else parsed.host
+    netloc = f"{parsed.userinfo}@{host}" if parsed.userinfo is not None else host
+    return f"{scheme}://{netloc}:{port}" if port else f"{scheme}://{netloc}"
+
 def _set_env_proxy_vars(url: str) -> None:
+    global _ENV_PROXY_SET
     if not url:
         return
-    for k in ("ALL_PROXY", "all_proxy", "HTTP_PROXY", "http_proxy", "HTTPS_PROXY", "https_proxy"):
-        os.environ[k] = url
+    if _ENV_PROXY_SET is None:
+        _ENV_PROXY_ORIG.update({k: os.environ.get(k) for k in _PROXY_VARS})
+    for k in _PROXY_VARS:
+        # só escreve o que mudou: os.environ[k] = ... também chama putenv
+        if os.environ.get(k) != url:
+            os.environ[k] = url
+    _ENV_PROXY_SET = url
+
+def _clear_env_proxy_vars() -> None:
+    """Desfaz _set_env_proxy_vars: restaura os *_PROXY de antes da primeira escrita (ou remove os que não existiam)."""
+    global _ENV_PROXY_SET
+    if _ENV_PROXY_SET is None:
+        return
+    for k in _PROXY_VARS:
+        orig = _ENV_PROXY_ORIG.get(k)
+        if orig is None:
+            os.environ.pop(k, None)
+        elif os.environ.get(k) != orig:
+            os.environ[k] = orig
+    _ENV_PROXY_ORIG.clear()
+    _ENV_PROXY_SET = None
 
 def _resolve_hostname(hostname: str) -> Optional[str]:
+    """Primeiro endereço (IPv4 ou IPv6) de `hostname`; resultados ficam em cache por _DNS_TTL segundos."""
+    hit = _DNS_CACHE.get(hostname)
+    if hit is not None and time.monotonic() - hit[0] < _DNS_TTL:
+        return hit[1]
+    import socket
+
     try:
-        return socket.gethostbyname(hostname)
+        infos = socket.getaddrinfo(hostname, None, family=socket.AF_UNSPEC, type=socket.SOCK_STREAM)
     except Exception:
+        return None  # falhas não entram no cache
+    if not infos:
         return None
-
-def _geo_check_ip(ip_check_url: str = "https://ipinfo.io/json") -> Dict[str, Any]:
+    addr = infos[0][4][0]
+    if len(_DNS_CACHE) >= _DNS_MAXSIZE:
+        _DNS_CACHE.pop(next(iter(_DNS_CACHE)))  # descarta a entrada mais antiga
+    _DNS_CACHE[hostname] = (time.monotonic(), addr)
+    return addr
+
+async def _geo_check_ip(
+    ip_check_url: str = "https://ipinfo.io/json",
+    proxy_url: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Consulta o IP de saída (via proxy_url, se dado); respostas OK ficam em cache por _GEO_TTL segundos."""
+    key = proxy_url or ip_check_url
+    hit = _GEO_CACHE.get(key)
+    if hit is not None:
+        if time.monotonic() - hit[0] < _GEO_TTL:
+            return hit[1]
+        del _GEO_CACHE[key]  # expirada: sai do cache em vez de ficar ocupando espaço
     try:
-        r = requests.get(ip_check_url, timeout=10)
+        # proxy explícito por cliente (e não via os.environ) para poder checar candidatos em paralelo
+        r = await _async_client(proxy_url).get(ip_check_url)
         r.raise_for_status()
-        return {"ok": True, "data": r.json()}
+        result = {"ok": True, "data": orjson.loads(r.content)}
     except Exception as e:
         return {"ok": False, "error": str(e)}
+    _GEO_CACHE.pop(key, None)
+    if len(_GEO_CACHE) >= _GEO_MAXSIZE:
+        _GEO_CACHE.pop(next(iter(_GEO_CACHE)))  # descarta a entrada mais antiga
+    _GEO_CACHE[key] = (time.monotonic(), result)
+    return result
 
-def _discover_mcp_router_via_fastcloud(api_url: str, token: str) -> Optional[str]:
+async def _discover_mcp_router_via_fastcloud(api_url: str, token: str) -> Optional[str]:
     """Hook genérico para discovery via API do FastCloud (ajuste conforme sua conta/endpoint)."""
     if not api_url or not token:
         return None
+    key = (api_url, hashlib.sha256(token.encode()).hexdigest()[:16])
+    stale = None
+    hit = _DISCO_CACHE.get(key)
+    if hit is not None:
+        age = time.monotonic() - hit[0]
+        if age < _DISCO_TTL:
+            return hit[1]
+        if age < 2 * _DISCO_TTL:
+            stale = hit[1]
+    import httpx
+
     try:
-        headers = {"Authorization": f"Bearer {token}"}
-        r = requests.get(api_url, headers=headers, timeout=8)
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Accept": "application/json",
+            "Accept-Encoding": "gzip",
+        }
+        # connect curto: um endpoint de discovery pendurado não pode travar o fallback
+        r = await _async_client().get(api_url, headers=headers, timeout=httpx.Timeout(8.0, connect=3.0))
         r.raise_for_status()
-        payload = r.json()
+        payload = orjson.loads(r.content)
         # ex.: {"router_address": "socks5://203.0.113.4:1080"} ou {"proxy_url": "..."}
-        return payload.get("router_address") or payload.get("proxy_url")
+        address = payload.get("router_address") or payload.get("proxy_url")
     except Exception:
-        return None
+        return stale
+    if not address:
+        return stale
+    _DISCO_CACHE[key] = (time.monotonic(), address)
+    return address
+
+def _breaker_is_open(cand: str) -> bool:
+    """Só consulta (não muda o estado): True se o candidato ainda está no cooldown."""
+    with _BREAKER_LOCK:
+        st = _BREAKER.get(cand)
+        return (
+            st is not None
+            and st["state"] != "closed"
+            and time.monotonic() - st["opened_at"] < _BREAKER_COOLDOWN
+        )
+
+def _breaker_allows(cand: str) -> bool:
+    """
+    False enquanto o circuito do candidato estiver aberto; após o cooldown libera uma tentativa (half-open).
+    A tentativa half-open também expira após o cooldown: se ela nunca registrar resultado
+    (ex. chamada cancelada), o candidato não fica bloqueado para sempre.
+    """
+    with _BREAKER_LOCK:
+        st = _BREAKER.get(cand)
+        if st is None or st["state"] == "closed":
+            return True
+        if time.monotonic() - st["opened_at"] < _BREAKER_COOLDOWN:
+            # aberto, ou half-open com uma tentativa de teste ainda em andamento
+            return False
+        st["state"] = "half"
+        st["opened_at"] = time.monotonic()
+        return True
+
+def _breaker_record(cand: str, ok: bool) -> None:
+    with _BREAKER_LOCK:
+        if ok:
+            _BREAKER.pop(cand, None)
+            return
+        st = _BREAKER.get(cand)
+        if st is None:
+            if len(_BREAKER) >= _BREAKER_MAXSIZE:
+                _BREAKER.pop(next(iter(_BREAKER)))  # descarta a entrada mais antiga
+            st = _BREAKER[cand] = {"fails": 0, "opened_at": 0.0, "state": "closed"}
+        st["fails"] += 1
+        # falha no teste half-open reabre direto; senão abre ao atingir o limite
+        if st["state"] == "half" or st["fails"] >= _BREAKER_FAILS:
+            st["state"] = "open"
+            st["opened_at"] = time.monotonic()
 
 # --------------------------
-# Core Notte (executa em thread pra não travar o event loop)
+# Cliente e sessões Notte reaproveitados entre chamadas
 # --------------------------
-def _run_notte_sync(
-    api_key: str,
-    target_url: str,
-    browser_type: str,
-    headless: bool,
-    locale: str,
-    mcp_proxy_url: Optional[str],
-    mcp_router_hostname: Optional[str],
-    fastcloud_api_url: Optional[str],
-    fastcloud_api_token: Optional[str],
-    skip_geo_check: bool,
-    force_use_mcp_router: bool,
-) -> Dict[str, Any]:
+_CLIENTS: Dict[str, "NotteClient"] = {}
+_CLIENTS_LOCK = threading.Lock()
 
-    client = NotteClient(api_key=api_key)
+def _get_client(api_key: str) -> "NotteClient":
+    """Um NotteClient por api_key durante a vida do processo."""
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get(api_key)
+        if client is None:
+            from notte_sdk import NotteClient
 
-    def _session_with_proxies(proxies_obj: Optional[NotteProxy]):
-        with client.Session(
-            solve_captchas=True,
-            browser_type=browser_type,
-            headless=headless,
-            proxies=proxies_obj,
-            locale=locale,
-        ) as session:
+            client = _CLIENTS[api_key] = NotteClient(api_key=api_key)
+        return client
+
+class _SessionPool:
+    """
+    Sessões Notte ociosas (já iniciadas) por chave (api_key, browser, headless, locale, rota),
+    reaproveitadas por até `max_age` segundos; cada sessão é emprestada a uma chamada por vez.
+    """
+
+    def __init__(self, max_age: float = 60.0) -> None:
+        self._max_age = max_age
+        self._idle: Dict[Tuple[Any, ...], List[Tuple[float, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key: Tuple[Any, ...]) -> Optional[Any]:
+        """Sessão ociosa ainda ativa na Notte para `key` (as que não estiverem são fechadas), ou None."""
+        with self._lock:
+            expired = self._pop_expired()
+        self._close(expired)
+        while True:
+            with self._lock:
+                entries = self._idle.get(key)
+                session = entries.pop()[1] if entries else None
+            if session is None or self._is_alive(session):
+                return session
+            self._close([session])
+
+    def release(self, key: Tuple[Any, ...], session: Any) -> None:
+        with self._lock:
+            self._idle.setdefault(key, []).append((time.monotonic(), session))
+        # fecha a sessão quando o TTL vencer, mesmo sem novas chamadas
+        timer = threading.Timer(self._max_age, self.evict_expired)
+        timer.daemon = True
+        timer.start()
+
+    def evict_expired(self) -> None:
+        with self._lock:
+            expired = self._pop_expired()
+        self._close(expired)
+
+    def close_all(self) -> None:
+        with self._lock:
+            sessions = [sess for entries in self._idle.values() for _, sess in entries]
+            self._idle.clear()
+        self._close(sessions)
+
+    def _pop_expired(self) -> List[Any]:
+        now = time.monotonic()
+        expired = []
+        for key in list(self._idle):
+            keep = []
+            for ts, sess in self._idle[key]:
+                (keep if now - ts < self._max_age else expired).append((ts, sess))
+            if keep:
+                self._idle[key] = keep
+            else:
+                del self._idle[key]
+        return [sess for _, sess in expired]
+
+    @staticmethod
+    def _is_alive(session: Any) -> bool:
+        try:
+            return session.status().status == "active"
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(sessions: List[Any]) -> None:
+        for sess in sessions:
+            try:
+                sess.__exit__(None, None, None)
+            except Exception:
+                pass
+
+# max_age bem abaixo do idle timeout padrão da Notte (3 min), para não emprestar sessões prestes a expirar
+_SESSIONS = _SessionPool(max_age=60.0)
+atexit.register(_SESSIONS.close_all)
+
+# --------------------------
+# Core Notte: HTTP (geo/discovery) roda no event loop; só a sessão Notte vai pra thread
+# --------------------------
+async def _run_notte(cfg: Config) -> Dict[str, Any]:
+    import traceback
+
+    client = _get_client(cfg.api_key)
+
+    def _run_agent(session: Any, pool_key: Optional[Tuple[Any, ...]]):
+        try:
             agent = client.Agent(session=session, max_steps=8)
             task = "Acesse a página, resolva quaisquer CAPTCHAs automaticamente e retorne um resumo"
-            resp = agent.run(task=task, url=target_url)
-            return getattr(resp, "answer", resp)
+            resp = agent.run(task=task, url=cfg.target_url)
+        except BaseException:
+            session.__exit__(*sys.exc_info())
+            raise
+        if pool_key is None:
+            session.__exit__(None, None, None)
+        else:
+            _SESSIONS.release(pool_key, session)
+        answer = getattr(resp, "answer", resp)
+        # o tool devolve isso como JSON: objetos arbitrários do SDK viram texto
+        if not isinstance(answer, (str, int, float, bool, dict, list, type(None))):
+            answer = str(answer)
+        return answer
+
+    def _session_with_proxies(proxies_obj: Optional["NotteProxy"], route: str):
+        # só sessões headless vão para o pool (mesma config + mesma rota de proxy)
+        pool_key = (cfg.api_key, cfg.browser_type, cfg.headless, cfg.locale, route) if cfg.headless else None
+        # o pool só devolve sessões confirmadas como ativas; falha do agente nelas é falha da chamada
+        pooled = _SESSIONS.acquire(pool_key) if pool_key is not None else None
+        if pooled is not None:
+            return _run_agent(pooled, pool_key)
+        session = client.Session(
+            solve_captchas=True,
+            browser_type=cfg.browser_type,
+            headless=cfg.headless,
+            proxies=proxies_obj,
+            locale=cfg.locale,
+        )
+        return _run_agent(session.__enter__(), pool_key)
 
     # 1) rota Notte BR (a não ser que force MCP)
-    if not force_use_mcp_router:
+    if not cfg.force_use_mcp_router:
         proxies_br = None
         try:
-            proxies_br = NotteProxy.from_country("br")
+            proxies_br = _notte_proxy_country("br")
         except Exception as e:
             proxies_br = None
 
         if proxies_br is not None:
+            _clear_env_proxy_vars()  # não deixa o proxy de um candidato MCP anterior vazar para a rota BR
             try:
-                answer = _session_with_proxies(proxies_br)
+                answer = await anyio.to_thread.run_sync(_session_with_proxies, proxies_br, "notte_proxy_br")
                 return {"status": "ok", "route": "notte_proxy_br", "result": answer}
             except Exception:
                 # segue para MCP
@@ -154,25 +549,32 @@ def _run_notte_sync(
     # 2) MCP candidates: MCP_PROXY_URL -> MCP_ROUTER_HOSTNAME -> FASTCLOUD API
     candidates = []
 
-    if mcp_proxy_url:
-        candidates.append(mcp_proxy_url.strip())
+    if cfg.mcp_proxy_url:
+        candidates.append(cfg.mcp_proxy_url.strip())
 
-    if mcp_router_hostname:
-        parsed = urlparse(mcp_router_hostname)
-        if parsed.scheme and parsed.hostname:
-            candidates.append(mcp_router_hostname.strip())
+    if cfg.mcp_router_hostname:
+        parsed = _parse_proxy_url(cfg.mcp_router_hostname)
+        if parsed is not None and parsed.scheme:
+            candidates.append(cfg.mcp_router_hostname.strip())
         else:
-            resolved = _resolve_hostname(mcp_router_hostname)
+            resolved = await anyio.to_thread.run_sync(_resolve_hostname, cfg.mcp_router_hostname)
             if resolved:
-                candidates.append(f"socks5://{resolved}:1080")
+                host = f"[{resolved}]" if ":" in resolved else resolved  # IPv6 entre colchetes
+                candidates.append(f"socks5://{host}:1080")
             else:
-                candidates.append(f"socks5://{mcp_router_hostname}:1080")
+                candidates.append(f"socks5://{cfg.mcp_router_hostname}:1080")
 
-    if fastcloud_api_url and fastcloud_api_token:
-        discovered = _discover_mcp_router_via_fastcloud(fastcloud_api_url, fastcloud_api_token)
+    if cfg.fastcloud_api_url and cfg.fastcloud_api_token:
+        discovered = await _discover_mcp_router_via_fastcloud(cfg.fastcloud_api_url, cfg.fastcloud_api_token)
         if discovered:
             candidates.append(discovered)
 
+    # normaliza e remove duplicatas (ex.: MCP_PROXY_URL igual ao endereço do discovery), mantendo a ordem
+    candidates = list(dict.fromkeys(_normalize_proxy_url(c) for c in candidates))
+    if _LAST_GOOD in candidates:
+        candidates.remove(_LAST_GOOD)
+        candidates.insert(0, _LAST_GOOD)
+
     if not candidates:
         return {
             "status": "error",
@@ -180,52 +582,120 @@ def _run_notte_sync(
             "error": "Sem MCP proxy/router: configure MCP_PROXY_URL, MCP_ROUTER_HOSTNAME ou FASTCLOUD_API_URL/TOKEN."
         }
 
-    last_err = None
-    for cand in candidates:
+    # a exceção é guardada crua e o traceback só é formatado uma vez, se todos falharem
+    last_err: Optional[str] = None
+    last_exc = None
+
+    async def _try_candidate(cand: str, geo: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        global _LAST_GOOD
+        nonlocal last_err, last_exc
+        if geo is not None and geo.get("ok"):
+            country = (geo["data"].get("country") or "").lower()
+            ipaddr = geo["data"].get("ip", "")
+            # Se ainda for BR e você quer IP externo, tenta o próximo.
+            # Não conta no circuit breaker (o proxy responde; só a saída é BR) e vem antes do
+            # _breaker_allows para não consumir a tentativa half-open
+            if country == "br":
+                last_err = f"candidate {cand} resulted in BR IP {ipaddr}"
+                return None
+
+        if not _breaker_allows(cand):
+            if last_err is None and last_exc is None:
+                last_err = f"candidate {cand} skipped: circuit open"
+            return None
+
         proxies_obj = _make_notte_proxy_from_url(cand)
         if proxies_obj is None:
             _set_env_proxy_vars(cand)
-
-        if not skip_geo_check:
-            geo = _geo_check_ip()
-            if geo.get("ok"):
-                country = (geo["data"].get("country") or "").lower()
-                ipaddr = geo["data"].get("ip", "")
-                # Se ainda for BR e você quer IP externo, tenta o próximo
-                if country == "br":
-                    last_err = f"candidate {cand} resulted in BR IP {ipaddr}"
-                    continue
+        else:
+            _clear_env_proxy_vars()
 
         try:
-            answer = _session_with_proxies(proxies_obj)
-            return {"status": "ok", "route": "mcp_proxy_used", "candidate": cand, "result": answer}
+            answer = await anyio.to_thread.run_sync(_session_with_proxies, proxies_obj, cand)
         except Exception:
-            last_err = traceback.format_exc()
-            continue
-
+            _breaker_record(cand, ok=False)
+            last_err, last_exc = None, sys.exc_info()
+            return None
+        _breaker_record(cand, ok=True)
+        _LAST_GOOD = cand
+        return {"status": "ok", "route": "mcp_proxy_used", "candidate": cand, "result": answer}
+
+    if cfg.skip_geo_check:
+        for cand in candidates:
+            result = await _try_candidate(cand, None)
+            if result is not None:
+                return result
+    else:
+        # geo-checks concorrentes: quem responder primeiro com IP (ok) não-BR ganha a primeira sessão Notte;
+        # os probes restantes seguem em paralelo e são cancelados assim que uma sessão der certo.
+        # Probe com erro (proxy morto costuma falhar na hora) não entra na corrida: esses candidatos
+        # só são tentados no fim, em ordem de prioridade, se nenhum saudável funcionar
+        async def _probe(cand: str) -> Tuple[str, Dict[str, Any]]:
+            return cand, await _geo_check_ip(proxy_url=cand)
+
+        for cand in candidates:
+            if _breaker_is_open(cand) and last_err is None:
+                last_err = f"candidate {cand} skipped: circuit open"
+        pending = {asyncio.create_task(_probe(c)) for c in candidates if not _breaker_is_open(c)}
+        failed_probe: List[Tuple[str, Dict[str, Any]]] = []
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # empate: respeita a ordem de prioridade da lista de candidatos
+                for cand, geo in sorted((t.result() for t in done), key=lambda r: candidates.index(r[0])):
+                    if not geo.get("ok"):
+                        failed_probe.append((cand, geo))
+                        continue
+                    result = await _try_candidate(cand, geo)
+                    if result is not None:
+                        return result
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        for cand, geo in sorted(failed_probe, key=lambda r: candidates.index(r[0])):
+            result = await _try_candidate(cand, geo)
+            if result is not None:
+                return result
+
+    if last_err is None and last_exc is not None:
+        last_err = "".join(traceback.format_exception(*last_exc))
     return {"status": "error", "route": "mcp_all_failed", "error": last_err}
 
 # --------------------------
 # Tools FastMCP
 # --------------------------
+def _tool_result(payload: Dict[str, Any]) -> ToolResult:
+    """
+    Texto da resposta serializado com orjson; structured_content é o próprio dict (o _run_agent já
+    converte respostas não-JSON do agente em str). Os tools seguem anotados com Dict[str, Any]
+    para o output schema.
+    """
+    return ToolResult(content=orjson.dumps(payload).decode(), structured_content=payload)
+
+# montado uma vez no import, como _CFG: as ENV não mudam durante a vida do processo
+_HEALTH: Dict[str, Any] = {
+    "server": "notte-mcp (fastmcp)",
+    "env": {
+        "NOTTE_API_KEY_set": bool(os.getenv("NOTTE_API_KEY")),
+        "TARGET_URL": os.getenv("TARGET_URL", "https://shopee.com.br"),
+        "MCP_PROXY_URL_set": bool(os.getenv("MCP_PROXY_URL")),
+        "MCP_ROUTER_HOSTNAME": os.getenv("MCP_ROUTER_HOSTNAME", ""),
+        "FASTCLOUD_API_URL_set": bool(os.getenv("FASTCLOUD_API_URL")),
+        "HEADLESS": os.getenv("HEADLESS", "False"),
+        "BROWSER_TYPE": os.getenv("BROWSER_TYPE", "firefox"),
+        "LOCALE": os.getenv("LOCALE", "pt-BR"),
+        "FORCE_USE_MCP_ROUTER": os.getenv("FORCE_USE_MCP_ROUTER", "False"),
+        "SKIP_GEO_CHECK": os.getenv("SKIP_GEO_CHECK", "False"),
+    }
+}
+
 @app.tool()
 async def health() -> Dict[str, Any]:
     """Retorna estado e envs principais para diagnóstico."""
-    return {
-        "server": "notte-mcp (fastmcp)",
-        "env": {
-            "NOTTE_API_KEY_set": bool(os.getenv("NOTTE_API_KEY")),
-            "TARGET_URL": os.getenv("TARGET_URL", "https://shopee.com.br"),
-            "MCP_PROXY_URL_set": bool(os.getenv("MCP_PROXY_URL")),
-            "MCP_ROUTER_HOSTNAME": os.getenv("MCP_ROUTER_HOSTNAME", ""),
-            "FASTCLOUD_API_URL_set": bool(os.getenv("FASTCLOUD_API_URL")),
-            "HEADLESS": os.getenv("HEADLESS", "False"),
-            "BROWSER_TYPE": os.getenv("BROWSER_TYPE", "firefox"),
-            "LOCALE": os.getenv("LOCALE", "pt-BR"),
-            "FORCE_USE_MCP_ROUTER": os.getenv("FORCE_USE_MCP_ROUTER", "False"),
-            "SKIP_GEO_CHECK": os.getenv("SKIP_GEO_CHECK", "False"),
-        }
-    }
+    # cópia para que ninguém altere o dict compartilhado
+    return _tool_result({**_HEALTH, "env": dict(_HEALTH["env"])})
 
 @app.tool()
 async def run_notte(
@@ -245,43 +715,19 @@ async def run_notte(
       - use_mcp_router (force fallback para MCP router/proxy)
       - skip_geo_check (pula validação do IP de saída)
     """
-    api_key = os.getenv("NOTTE_API_KEY", "")
-    if not api_key or api_key == "SUA_CHAVE_API_PRO":
-        return {"status": "error", "error": "NOTTE_API_KEY não definido nas variáveis de ambiente."}
-
-    env_target = os.getenv("TARGET_URL", "https://shopee.com.br")
-    env_headless = _str_to_bool(os.getenv("HEADLESS", "False"), default=False)
-    env_browser = os.getenv("BROWSER_TYPE", "firefox")
-    env_locale = os.getenv("LOCALE", "pt-BR")
-    env_force_mcp = _str_to_bool(os.getenv("FORCE_USE_MCP_ROUTER", "False"))
-    env_skip_geo = _str_to_bool(os.getenv("SKIP_GEO_CHECK", "False"))
-
-    mcp_proxy_url = os.getenv("MCP_PROXY_URL", "").strip()
-    mcp_router_hostname = os.getenv("MCP_ROUTER_HOSTNAME", "").strip()
-    fastcloud_api_url = os.getenv("FASTCLOUD_API_URL", "").strip()
-    fastcloud_api_token = os.getenv("FASTCLOUD_API_TOKEN", "").strip()
-
-    final_target = target_url or env_target
-    final_headless = env_headless if headless is None else bool(headless)
-    final_browser = browser_type or env_browser
-    final_locale = locale or env_locale
-    final_use_mcp = env_force_mcp if use_mcp_router is None else bool(use_mcp_router)
-    final_skip_geo = env_skip_geo if skip_geo_check is None else bool(skip_geo_check)
-
-    return await anyio.to_thread.run_sync(
-        _run_notte_sync,
-        api_key,
-        final_target,
-        final_browser,
-        final_headless,
-        final_locale,
-        mcp_proxy_url,
-        mcp_router_hostname,
-        fastcloud_api_url,
-        fastcloud_api_token,
-        final_skip_geo,
-        final_use_mcp,
+    if not _CFG.api_key or _CFG.api_key == "SUA_CHAVE_API_PRO":
+        return _tool_result({"status": "error", "error": "NOTTE_API_KEY não definido nas variáveis de ambiente."})
+
+    cfg = dataclasses.replace(
+        _CFG,
+        target_url=target_url or _CFG.target_url,
+        headless=_CFG.headless if headless is None else bool(headless),
+        browser_type=browser_type or _CFG.browser_type,
+        locale=locale or _CFG.locale,
+        force_use_mcp_router=_CFG.force_use_mcp_router if use_mcp_router is None else bool(use_mcp_router),
+        skip_geo_check=_CFG.skip_geo_check if skip_geo_check is None else bool(skip_geo_check),
     )
+    return _tool_result(await _run_notte(cfg))
 
 # Importante: no FastMCP Cloud normalmente basta exportar `app`.
 # Mas deixar um main ajuda localmente: